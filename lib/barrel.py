@@ -10,8 +10,12 @@ License: MIT (see the details at the very bottom)
 """
 
 from __future__ import annotations
-from typing import List, Any, Dict
+from typing import List, Any, Dict, Callable, Iterator, Sequence, Tuple
 from abc import ABC, abstractmethod
+from collections import defaultdict, OrderedDict
+from contextlib import contextmanager
+from operator import itemgetter
+from types import MappingProxyType
 import sqlite3
 
 __author__ = 'bagasjs'
@@ -25,11 +29,18 @@ def pluck(record: Record, keys: List[str]) -> Record:
     return { key : record[key] for key in keys }
 
 def plucks(records: Records, keys: List[str]) -> Records:
-    return [ { key: record[key] for key in keys } for record in records ]
+    keys = tuple(keys)
+    if len(keys) == 0:
+        return [ {} for _ in records ]
+    getter = itemgetter(*keys)
+    if len(keys) == 1:
+        key = keys[0]
+        return [ { key: getter(record) } for record in records ]
+    return [ dict(zip(keys, getter(record))) for record in records ]
 
 def unplucks(records: Records, key: str, value: Any) -> Records:
-    for i in range(len(records)):
-        records[i][key] = value
+    for record in records:
+        record[key] = value
     return records
 
 MIGRATION_TABLE_NAME = "_barrel_migrations"
@@ -44,13 +55,49 @@ DTYPE_DATE     = "DATE"
 DTYPE_TIME     = "TIME"
 DTYPE_DATETIME = "DATETIME"
 
+# Comparison operators allowed in a WHERE clause, the operator is put into the SQL as is
+WHERE_OPERATORS = frozenset({ "=", "==", "!=", "<>", "<", "<=", ">", ">=", "LIKE", "NOT LIKE", "GLOB", "NOT GLOB", "IS", "IS NOT" })
+
+# ((lhs, op, is_or), ...) of the WHERE clauses of a query
+WhereShape = Tuple[Tuple[str, str, bool], ...]
+CompiledQuery = Callable[[Sequence[Any]], Tuple[str, List[Any]]]
+
+def _where_parts(parts: List[str], shape: WhereShape):
+    if len(shape) > 0:
+        parts.append(" WHERE ")
+        for i, (lhs, op, is_or) in enumerate(shape):
+            if i != 0:
+                parts.append(" OR " if is_or else " AND ")
+            parts.append(lhs)
+            parts.append(" ")
+            parts.append(op)
+            parts.append(" ?")
+
+def _compile_select(table_name: str, selected_columns: Tuple[str, ...], shape: WhereShape) -> CompiledQuery:
+    parts = [ "SELECT ", ",".join(selected_columns) if selected_columns else "*", " FROM ", table_name ]
+    _where_parts(parts, shape)
+    sql = "".join(parts)
+    def query(values: Sequence[Any]) -> Tuple[str, List[Any]]:
+        return sql, list(values)
+    return query
+
 class WhereClause(object):
+    __slots__ = ("is_or", "lhs", "op", "rhs")
     is_or: bool
     lhs: str
     op: str
     rhs: Any
 
+    def __init__(self, is_or: bool, lhs: str, op: str, rhs: Any):
+        self.is_or = is_or
+        self.lhs = lhs
+        self.op = op
+        self.rhs = rhs
+
 class Field(object):
+    __slots__ = ("name", "datatype", "default_value", "is_nullable", "is_unique", "is_primarykey", 
+                 "is_foreignkey", "referenced_table_name", "referenced_field_name")
+
     def __init__(self, 
                  name: str, 
                  datatype: str, 
@@ -73,11 +120,30 @@ class Field(object):
         self.referenced_field_name = referenced_field_name
 
 class Entity(object):
-    def __init__(self, data: Record, ctx: Context, repo: Repository):
-        self.data = data
+    """
+    Reads go straight to the wrapped row while writes are kept in `_dirty`
+    until the entity is saved
+    """
+    __slots__ = ("_row", "_dirty", "ctx", "repo")
+    _row: sqlite3.Row | Record
+    _dirty: Record | None
+
+    def __init__(self, row: sqlite3.Row | Record, ctx: Context, repo: Repository):
+        self._row = row
+        self._dirty = None
         self.ctx = ctx
         self.repo = repo
 
+    @property
+    def data(self) -> MappingProxyType[str, Any]:
+        """
+        A read-only snapshot of the columns, write through `entity["column"] = value` instead
+        """
+        data = dict(self._row)
+        if self._dirty:
+            data.update(self._dirty)
+        return MappingProxyType(data)
+
     def belongs_to(self):
         pass
 
@@ -87,28 +153,65 @@ class Entity(object):
     def belongs_to_many(self):
         pass
 
+    def save(self, key: str = "id"):
+        """
+        Update only the changed columns of the row matched by its `key` column
+        """
+        if not self._dirty:
+            return
+        self.repo.where_eq(key, self._row[key]).update(self._dirty)
+        row = dict(self._row)
+        row.update(self._dirty)
+        self._row = row
+        self._dirty = None
+
     def __getitem__(self, key: str):
-        return self.data[key]
+        if self._dirty and key in self._dirty:
+            return self._dirty[key]
+        return self._row[key]
 
     def __setitem__(self, key: str, value: Any):
-        self.data[key] = value
+        if self._dirty is None:
+            self._dirty = {}
+        self._dirty[key] = value
 
 class QueryResult(object):
+    __slots__ = ("_cursor", "_columns")
     _cursor: sqlite3.Cursor
-    _columns: List[str]
+    _columns: Tuple[str, ...]
 
     def __init__(self, cursor: sqlite3.Cursor):
         self._cursor = cursor
         self._columns = (
-            [ desc[0] for desc in self._cursor.description ] 
-            if self._cursor.description else []
+            tuple(desc[0] for desc in self._cursor.description)
+            if self._cursor.description else ()
         )
 
-    def next(self) -> Dict[str, Any] | None:
-        data = self._cursor.fetchone()
-        if data is None:
-            return None
-        return dict(zip(self._columns, data)) 
+    def next(self) -> sqlite3.Row | None:
+        """
+        Get the next row. A row supports both `row["column"]` and `dict(row)`
+        """
+        return self._cursor.fetchone()
+
+    def all(self) -> List[sqlite3.Row]:
+        return self._cursor.fetchall()
+
+    def __iter__(self) -> Iterator[sqlite3.Row]:
+        return iter(self._cursor)
+
+    def as_dicts(self) -> Records:
+        columns = self._columns
+        return [ dict(zip(columns, row)) for row in self._cursor.fetchall() ]
+
+    def iter_batched(self, size: int = 1000) -> Iterator[sqlite3.Row]:
+        """
+        Iterate over the remaining rows while fetching `size` rows at a time
+        """
+        fetchmany = self._cursor.fetchmany
+        rows = fetchmany(size)
+        while rows:
+            yield from rows
+            rows = fetchmany(size)
 
 class Repository(object):
     """
@@ -160,17 +263,37 @@ class Repository(object):
         if len(constraint_sqls) > 0:
             res += f",\n\t{',\n\t'.join(constraint_sqls)}"
         res += "\n)"
-        cur = self._ctx._conn.cursor()
-        cur.execute(res)
+        self._ctx._cursor.execute(res)
+        self._ctx._table_columns_cache.pop(self._table_name, None)
 
     def drop_table(self):
-        cur = self._ctx._conn.cursor()
-        cur.execute("DROP TABLE " + self._table_name)
+        self._ctx._cursor.execute("DROP TABLE " + self._table_name)
+        self._ctx._table_columns_cache.pop(self._table_name, None)
 
     def table_exist(self) -> bool:
-        cur = self._ctx._conn.execute(f'SELECT name FROM sqlite_master WHERE type="table" AND name="{self._table_name}"')
+        cur = self._ctx._conn.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name=?", (self._table_name,))
         return cur.fetchone() is not None 
 
+    def _check_clause(self, lhs: str, op: str) -> str:
+        """
+        Column names and operators are put into the SQL as is so only allow the columns the
+        table actually has and the operators in WHERE_OPERATORS. Returns the normalized operator
+        """
+        # SQLite identifiers are case-insensitive
+        column = lhs.casefold()
+        columns = self._ctx._table_columns(self._table_name)
+        if column not in columns:
+            # The table might have been created or altered behind the cache's back
+            columns = self._ctx._table_columns(self._table_name, refresh=True)
+        if not columns:
+            raise ValueError(f"Unknown table `{self._table_name}`")
+        if column not in columns:
+            raise ValueError(f"Unknown column `{lhs}` for table `{self._table_name}`")
+        normalized_op = " ".join(op.upper().split())
+        if normalized_op not in WHERE_OPERATORS:
+            raise ValueError(f"Unsupported operator `{op}` in WHERE clause")
+        return normalized_op
+
     # Query Builder functions
     def reset(self):
         self._order_by = ""
@@ -178,21 +301,13 @@ class Repository(object):
         self._where_clauses = []
 
     def where(self, lhs: str, op: str, rhs: Any) -> Repository:
-        clause = WhereClause()
-        clause.is_or = False
-        clause.lhs = lhs
-        clause.op = op
-        clause.rhs = rhs
-        self._where_clauses.append(clause)
+        op = self._check_clause(lhs, op)
+        self._where_clauses.append(WhereClause(False, lhs, op, rhs))
         return self
 
     def or_where(self, lhs: str, op: str, rhs: Any) -> Repository:
-        clause = WhereClause()
-        clause.is_or = True
-        clause.lhs = lhs
-        clause.op = op
-        clause.rhs = rhs
-        self._where_clauses.append(clause)
+        op = self._check_clause(lhs, op)
+        self._where_clauses.append(WhereClause(True, lhs, op, rhs))
         return self
 
     def where_eq(self, lhs: str, rhs: Any) -> Repository:
@@ -201,23 +316,32 @@ class Repository(object):
     def or_where_eq(self, lhs: str, rhs: Any) -> Repository:
         return self.or_where(lhs, "=", rhs)
 
+    def _where_shape(self) -> WhereShape:
+        return tuple((clause.lhs, clause.op, clause.is_or) for clause in self._where_clauses)
+
+    def _where_args(self) -> List[Any]:
+        return [ clause.rhs for clause in self._where_clauses ]
+
+    def compile(self, shape: WhereShape) -> CompiledQuery:
+        """
+        Compile the SELECT query for a WHERE shape `((lhs, op, is_or), ...)` into a function 
+        that takes the right hand side values of the clauses and returns the SQL with its
+        arguments. Repeated query shapes reuse the same compiled function.
+        Raises ValueError for an unknown column or an unsupported operator.
+        """
+        table_name = self._table_name
+        selected_columns = tuple(self._selected_columns)
+        def build() -> CompiledQuery:
+            # The shape can come straight from the caller so check it like where() does,
+            # only on a cache miss since a cached shape has already been checked
+            checked_shape = tuple((lhs, self._check_clause(lhs, op), is_or) for lhs, op, is_or in shape)
+            return _compile_select(table_name, selected_columns, checked_shape)
+        return self._ctx._statement(("SELECT", table_name, selected_columns, shape), build)
+
     # Execution functions
     def get(self):
-        selected_columns = "*"
-        if len(self._selected_columns) > 0:
-            selected_columns = ",".join(self._selected_columns)
-        query = f"SELECT {selected_columns} FROM {self._table_name}"
-        args = []
-        if len(self._where_clauses) > 0:
-            query += " WHERE "
-            for i, clause in enumerate(self._where_clauses):
-                if i != 0:
-                    if clause.is_or:
-                        query += " OR "
-                    else:
-                        query += " AND "
-                query += f"{clause.lhs} {clause.op} ?"
-                args.append(clause.rhs)
+        query, args = self.compile(self._where_shape())(self._where_args())
+        # A fresh cursor since the result is consumed lazily by the caller
         cur = self._ctx._conn.cursor()
         cur = cur.execute(query, args)
         self.reset()
@@ -225,83 +349,163 @@ class Repository(object):
 
     def all(self) -> List[Dict[str, Any]]:
         self.reset()
-        res = self.get()
-        data = res.next()
-        result = []
-        while data:
-            result.append(data)
-            data = res.next()
-        return result
+        return self.get().as_dicts()
 
     def first(self) -> Dict[str, Any] | None:
-        res = self.get()
-        data = res.next()
-        if not data:
-            return None
-        return data
+        row = self.get().next()
+        return dict(row) if row is not None else None
     
     def insert(self, record: Dict[str, Any]):
-        keys = []
-        placeholders = []
-        values = []
-        for key, value in record.items():
-            keys.append(key)
-            placeholders.append("?")
-            values.append(value)
-
-        sql = f"INSERT INTO {self._table_name}({','.join(keys)}) VALUES ({','.join(placeholders)})"
-        cur = self._ctx._conn.cursor()
-        cur = cur.execute(sql, values)
+        keys = tuple(record.keys())
+        def build() -> str:
+            return f"INSERT INTO {self._table_name}({','.join(keys)}) VALUES ({','.join('?' * len(keys))})"
+        sql = self._ctx._statement(("INSERT", self._table_name, keys), build)
+        self._ctx._cursor.execute(sql, list(record.values()))
+        self.reset()
+
+    def insert_many(self, records: Records):
+        """
+        Insert all the records with a single executemany per distinct set of keys
+        """
+        groups = defaultdict(list)
+        for record in records:
+            groups[tuple(record.keys())].append(tuple(record.values()))
+
+        conn = self._ctx._conn
+        for keys, rows in groups.items():
+            sql = f"INSERT INTO {self._table_name}({','.join(keys)}) VALUES ({','.join('?' * len(keys))})"
+            conn.executemany(sql, rows)
         self.reset()
 
     def update(self, record: Dict[str, Any]):
-        args = []
-        query = f"UPDATE {self._table_name} SET"
-        for key, value in record.items():
-            query += f" {key} = ?"
-            args.append(value)
-
-        if len(self._where_clauses) > 0:
-            query += " WHERE "
-            for i, clause in enumerate(self._where_clauses):
-                if i != 0:
-                    if clause.is_or:
-                        query += " OR "
-                    else:
-                        query += " AND "
-                query += f"{clause.lhs} {clause.op} ?"
-                args.append(clause.rhs)
+        shape = self._where_shape()
+        key = ("UPDATE", self._table_name, tuple(record.keys()), shape)
+        def build() -> str:
+            parts = [ "UPDATE ", self._table_name, " SET ", ", ".join(f"{column} = ?" for column in record.keys()) ]
+            _where_parts(parts, shape)
+            return "".join(parts)
+        query = self._ctx._statement(key, build)
+        args = list(record.values())
+        args.extend(self._where_args())
+        self._ctx._cursor.execute(query, args)
+        self.reset()
 
-        cur = self._ctx._conn.cursor()
-        cur = cur.execute(query, args)
+    def update_many(self, records: Records, key: str = "id"):
+        """
+        Update every record matched by its `key` column with a single executemany 
+        per distinct set of columns. Records with nothing but the `key` have nothing to update
+        """
+        groups = defaultdict(list)
+        for record in records:
+            if key not in record:
+                raise ValueError(f"Record is missing the key column `{key}`: {record}")
+            columns = tuple(column for column in record.keys() if column != key)
+            if not columns:
+                continue
+            groups[columns].append(tuple(record[column] for column in columns) + (record[key],))
+
+        conn = self._ctx._conn
+        for columns, rows in groups.items():
+            assignments = ", ".join(f"{column} = ?" for column in columns)
+            sql = f"UPDATE {self._table_name} SET {assignments} WHERE {key} = ?"
+            conn.executemany(sql, rows)
         self.reset()
 
     def delete(self):
-        query = f"DELETE FROM {self._table_name}"
-        args = []
-        if len(self._where_clauses) > 0:
-            query += " WHERE "
-            for i, clause in enumerate(self._where_clauses):
-                if i != 0:
-                    if clause.is_or:
-                        query += " OR "
-                    else:
-                        query += " AND "
-                query += f"{clause.lhs} {clause.op} ?"
-                args.append(clause.rhs)
-        cur = self._ctx._conn.cursor()
-        cur = cur.execute(query, args)
+        shape = self._where_shape()
+        key = ("DELETE", self._table_name, shape)
+        def build() -> str:
+            parts = [ "DELETE FROM ", self._table_name ]
+            _where_parts(parts, shape)
+            return "".join(parts)
+        query = self._ctx._statement(key, build)
+        self._ctx._cursor.execute(query, self._where_args())
         self.reset()
 
 class Context(object):
     _conn: sqlite3.Connection
+    _cursor: sqlite3.Cursor
+    _stmt_cache: OrderedDict[tuple, Any]
+    _stmt_cache_size: int
+    _table_columns_cache: Dict[str, frozenset[str]]
+    _transaction_depth: int
 
-    def __init__(self, config: str):
+    def __init__(self, config: str, stmt_cache_size: int = 100):
         self._conn = sqlite3.connect(config)
+        self._conn.row_factory = sqlite3.Row
+        self._cursor = self._conn.cursor()
+        self._stmt_cache = OrderedDict()
+        self._stmt_cache_size = stmt_cache_size
+        self._table_columns_cache = {}
+        self._transaction_depth = 0
+
+    def _table_columns(self, table_name: str, refresh: bool = False) -> frozenset[str]:
+        """
+        Get the case-folded column names of a table. An empty set means the table doesn't
+        exist (yet) and isn't cached so a table created later is picked up. `refresh` reads
+        the columns again, e.g. after an ALTER TABLE
+        """
+        columns = None if refresh else self._table_columns_cache.get(table_name)
+        if columns is None:
+            cur = self._conn.execute("SELECT name FROM pragma_table_info(?)", (table_name,))
+            columns = frozenset(row[0].casefold() for row in cur.fetchall())
+            if columns:
+                self._table_columns_cache[table_name] = columns
+        return columns
+
+    def _statement(self, key: tuple, build: Callable[[], Any]) -> Any:
+        """
+        Get the SQL string (or the compiled SELECT) for a query shape from the LRU cache
+        or build it with `build` when it's not cached yet
+        """
+        cache = self._stmt_cache
+        sql = cache.get(key)
+        if sql is not None:
+            cache.move_to_end(key)
+            return sql
+        sql = build()
+        cache[key] = sql
+        if len(cache) > self._stmt_cache_size:
+            cache.popitem(last=False)
+        return sql
 
     def repo(self, table_name: str) -> Repository:
         return Repository(table_name, self)
 
+    @contextmanager
+    def transaction(self):
+        """
+        Run every statement inside the `with` block as a single transaction.
+        Commit when the block exits normally and rollback otherwise. When a
+        transaction is already open (a nested block, or sqlite3's implicit one
+        after an INSERT/UPDATE/DELETE) the block becomes a savepoint so it only
+        undoes its own statements and leaves the commit to whoever opened it
+        """
+        conn = self._conn
+        depth = self._transaction_depth
+        owns_transaction = not conn.in_transaction
+        if owns_transaction:
+            conn.execute("BEGIN")
+        else:
+            conn.execute(f"SAVEPOINT barrel_{depth}")
+        self._transaction_depth = depth + 1
+        try:
+            yield self
+        except BaseException:
+            if owns_transaction:
+                conn.rollback()
+            else:
+                conn.execute(f"ROLLBACK TO barrel_{depth}")
+                conn.execute(f"RELEASE barrel_{depth}")
+            raise
+        else:
+            if owns_transaction:
+                conn.commit()
+            else:
+                conn.execute(f"RELEASE barrel_{depth}")
+        finally:
+            self._transaction_depth = depth
+
 """
 Copyright (c) 2025 bagasjs
 
@@ -8,60 +8,171 @@ Copyright (c) 2025, bagasjs
 License: MIT (see the details at the very bottom)
 """
 from __future__ import annotations
-from typing import List, Dict, Any, Optional, Union
+from typing import List, Dict, Any, Optional, Tuple, Union
 from html.parser import HTMLParser
 from html.entities import name2codepoint
+from html import unescape
+from bisect import bisect_left, bisect_right
+import re
+import sys
 
 # TODOs
-# - in DOMNode at least in DOMNode._build_tag_index it will include itself into the indexes. This should not be happening
+# - DOMNode.get_by_* includes the node itself in the results. This should not be happening
 #   Although we don't need to remove it in DOMDocument since we might need it
 # - A better HTML Parser (maybe)
 
+# Tag names and attribute keys are interned so the indexes and the attrs of every node share the same strings
+_ID_ATTR = sys.intern("id")
+_CLASS_ATTR = sys.intern("class")
+
+# Distance between the positions of two consecutive nodes when the indexes are built, the
+# gaps leave room to number nodes appended later without renumbering the whole document
+_INDEX_GAP = 1 << 32
+
+def _build_all_indices(root: DOMNode, start: int = 0, step: int = _INDEX_GAP
+                       ) -> Tuple[Dict[str, List[DOMNode]], Dict[str, DOMNode], Dict[str, List[DOMNode]]]:
+    """
+    Walk the tree under `root` (including itself) once in document order and
+    build the tag, id and class indexes all at the same time. Every node also gets
+    its position in the walk (`start`, `start + step`, ...) so the indexes can be
+    filtered by subtree later
+    """
+    tag_map: Dict[str, List[DOMNode]] = {}
+    id_map: Dict[str, DOMNode] = {}
+    class_map: Dict[str, List[DOMNode]] = {}
+    order: List[DOMNode] = []
+    stack = [ root ]
+    while stack:
+        node = stack.pop()
+        node._index_start = start + len(order) * step
+        order.append(node)
+        tag_map.setdefault(node.tag, []).append(node)
+        attrs = node.attrs
+        id_attr = attrs.get(_ID_ATTR)
+        if id_attr:
+            id_map[id_attr] = node
+        class_attr = attrs.get(_CLASS_ATTR)
+        if class_attr:
+            if isinstance(class_attr, str):
+                classes = class_attr.split()
+            elif isinstance(class_attr, list):
+                classes = class_attr
+            else:
+                classes = [ str(class_attr) ]
+            for class_name in classes:
+                class_map.setdefault(class_name, []).append(node)
+        for child in reversed(node.children):
+            if isinstance(child, DOMNode):
+                child._parent = node
+                stack.append(child)
+
+    # A subtree ends where the subtree of its last element child ends
+    for node in reversed(order):
+        node._index_end = node._index_start
+        for child in reversed(node.children):
+            if isinstance(child, DOMNode):
+                node._index_end = child._index_end
+                break
+    return tag_map, id_map, class_map
+
+def _within(nodes: Optional[List[DOMNode]], node: DOMNode) -> Optional[List[DOMNode]]:
+    """
+    Filter the nodes of an index (which are in document order) to the ones inside the subtree of `node`
+    """
+    if nodes is None:
+        return None
+    lo = bisect_left(nodes, node._index_start, key=_index_start_of)
+    hi = bisect_right(nodes, node._index_end, key=_index_start_of)
+    return nodes[lo:hi] or None
+
+def _index_start_of(node: DOMNode) -> int:
+    return node._index_start
+
+def _merge_nodes(index: Dict[str, List[DOMNode]], new_index: Dict[str, List[DOMNode]]):
+    """
+    Merge the index of a new subtree into an existing one, both are in document order
+    and the new nodes are next to each other in the document
+    """
+    for key, new_nodes in new_index.items():
+        nodes = index.get(key)
+        if nodes is None:
+            index[key] = new_nodes
+        else:
+            at = bisect_left(nodes, new_nodes[0]._index_start, key=_index_start_of)
+            nodes[at:at] = new_nodes
+
+def _attach(root: DOMNode, document: Optional[DOMDocument]):
+    stack = [ root ]
+    while stack:
+        node = stack.pop()
+        node._document = document
+        stack.extend(child for child in node.children if isinstance(child, DOMNode))
+
+# Indentation strings used by DOMNode._render, extended on demand for deeper trees
+_INDENT_CACHE: List[str] = [ "  " * depth for depth in range(16) ]
+
 class DOMNode(object):
+    __slots__ = ("tag", "attrs", "children", "_parent", "_document", "_index_start", "_index_end")
     tag: str
     attrs: Dict[str, Any]
     children: List[Union[DOMNode, str]]
 
-    # NOTE: This will be duplicating some indexes from DOMDocument and since an ID is unique per element there's no need to have this
-    _id_to_node_map: Dict[str, DOMNode]
-    _tag_to_node_map: Dict[str, List[DOMNode]]
-    _class_to_node_map: Dict[str, List[DOMNode]]
-    _has_id_index: bool
-    _has_tag_index: bool
-    _has_class_index: bool
+    # The indexes only live in DOMDocument, a node only knows the document it belongs to
+    # and its position in the document order to filter the document's indexes
+    _parent: Optional[DOMNode]
+    _document: Optional[DOMDocument]
+    _index_start: int
+    _index_end: int
 
     def __init__(self, tag: str, attrs: Dict[str, Any], children: Optional[List[Union[DOMNode, str]]] = None):
         self.tag = tag
         self.attrs = attrs
         self.children = children or []
-
-        self._has_id_index = False
-        self._id_to_node_map  = {}
-
-        self._has_tag_index = False
-        self._tag_to_node_map = {}
-
-        self._has_class_index = False
-        self._class_to_node_map = {}
+        self._parent = None
+        self._document = None
+        self._index_start = 0
+        self._index_end = 0
 
     def append_child(self, child: Union[DOMNode, str]):
         self.children.append(child)
+        # Text is never indexed so only elements need to touch the indexes
+        if isinstance(child, DOMNode):
+            child._parent = self
+            document = self._document
+            if child._document is not document:
+                if child._document is not None:
+                    # The nodes leave the indexes of their old document
+                    child._document._indices_dirty = True
+                _attach(child, document)
+                if document is not None:
+                    document._insert_subtree(self, child)
+            elif document is not None:
+                # The node is moved within the same document
+                document._indices_dirty = True
 
     def _render(self, indent: int = 0) -> str:
-        space = "  " * indent
-        attrs = " ".join(f'{key}="{value}"' for key, value in self.attrs.items())
-        open_tag = f"<{self.tag}{' ' + attrs if attrs else ''}>"
-        close_tag = f"</{self.tag}>"
-        parts = [f"{space}{open_tag}"]
-
-        for child in self.children:
-            if isinstance(child, DOMNode):
-                parts.append(child._render(indent + 1))
-            elif isinstance(child, str):
-                parts.append(f"{'  ' * (indent + 1)}{child}")
-
-        parts.append(f"{space}{close_tag}")
-        return "\n".join(parts)
+        lines: List[str] = []
+        # (node, depth, is the closing tag)
+        stack: List[Tuple[Union[DOMNode, str], int, bool]] = [ (self, indent, False) ]
+        indents = _INDENT_CACHE
+        while stack:
+            node, depth, closing = stack.pop()
+            while depth >= len(indents):
+                indents.append("  " * len(indents))
+            space = indents[depth]
+            if isinstance(node, str):
+                lines.append(space + node)
+            elif closing:
+                lines.append(f"{space}</{node.tag}>")
+            else:
+                if node.attrs:
+                    attrs = " ".join([ f'{key}="{value}"' for key, value in node.attrs.items() ])
+                    lines.append(f"{space}<{node.tag} {attrs}>")
+                else:
+                    lines.append(f"{space}<{node.tag}>")
+                stack.append((node, depth, True))
+                stack.extend((child, depth + 1, False) for child in reversed(node.children))
+        return "\n".join(lines)
 
     def __str__(self) -> str:
         return self._render()
@@ -74,71 +185,32 @@ class DOMNode(object):
         else:
             return f"<{self.tag}>"
 
-    # TODO: since this is recursion maybe recursion unwrapping would be nice
-    #       Look at https://github.com/bagasjs/algo-impl/blob/main/traversal.py
-    def _build_tag_index(self, node: DOMNode):
-        if node.tag not in self._tag_to_node_map:
-            self._tag_to_node_map[node.tag] = []
-        self._tag_to_node_map[node.tag].append(node)
-        for child in node.children:
-            if isinstance(child, DOMNode):
-                self._build_tag_index(child)
-        if node is self:
-            self._has_tag_index = True
-
-    # TODO: since this is recursion maybe recursion unwrapping would be nice
-    #       Look at https://github.com/bagasjs/algo-impl/blob/main/traversal.py
-    def _build_id_index(self, node: DOMNode):
-        id_attr = node.attrs.get("id")
-        if id_attr:
-            self._id_to_node_map[id_attr] = node
-        for child in node.children:
-            if isinstance(child, DOMNode):
-                self._build_id_index(child)
-        if node is self:
-            self._has_id_index = True
-
-    # TODO: since this is recursion maybe recursion unwrapping would be nice
-    #       Look at https://github.com/bagasjs/algo-impl/blob/main/traversal.py
-    def _build_class_index(self, node: DOMNode):
-        class_attr = node.attrs.get("class")
-        if class_attr:
-            classes = []
-            if isinstance(class_attr, str):
-                classes.extend(class_attr.split())
-            elif isinstance(class_attr, list):
-                classes.extend(class_attr)
-            else:
-                classes.append(str(class_attr))
-            for class_name in classes:
-                if class_name not in self._class_to_node_map:
-                    self._class_to_node_map[class_name] = []
-                self._class_to_node_map[class_name].append(node)
-
-        for child in node.children:
-            if isinstance(child, DOMNode):
-                self._build_class_index(child)
-
-        if node is self:
-            self._has_class_index = True
+    def _indexed_document(self) -> DOMDocument:
+        if self._document is None:
+            # A node that isn't part of any document becomes the root of its own
+            DOMDocument(self, None)
+        assert self._document is not None
+        return self._document
 
     def inner_text(self) -> str:
-        return "".join([str(child) for child in self.children])
+        parts: List[str] = []
+        stack = list(reversed(self.children))
+        while stack:
+            node = stack.pop()
+            if isinstance(node, str):
+                parts.append(node)
+            else:
+                stack.extend(reversed(node.children))
+        return "".join(parts)
 
     def get_by_tag(self, name: str) -> Optional[List[DOMNode]]:
-        if not self._has_tag_index:
-            self._build_tag_index(self)
-        return self._tag_to_node_map.get(name)
+        return self._indexed_document().get_by_tag(name, within=self)
 
     def get_by_id(self, name: str) -> Optional[DOMNode]:
-        if not self._has_id_index:
-            self._build_id_index(self)
-        return self._id_to_node_map.get(name)
+        return self._indexed_document().get_by_id(name, within=self)
 
     def get_by_class_name(self, name: str) -> Optional[List[DOMNode]]:
-        if not self._has_class_index:
-            self._build_class_index(self)
-        return self._class_to_node_map.get(name)
+        return self._indexed_document().get_by_class_name(name, within=self)
 
 class DOMDocument(object):
     root: DOMNode
@@ -147,117 +219,242 @@ class DOMDocument(object):
     _id_to_node_map: Dict[str, DOMNode]
     _tag_to_node_map: Dict[str, List[DOMNode]]
     _class_to_node_map: Dict[str, List[DOMNode]]
-    _has_id_index: bool
-    _has_tag_index: bool
-    _has_class_index: bool
+    _indices_dirty: bool
+    # The document that owns the nodes when `root` already belonged to one
+    _owner: Optional[DOMDocument]
 
     def __init__(self, root: DOMNode, page_title: Union[str, None]):
         self.root = root
         self.page_title = page_title
-        self._has_id_index = False
+        self._indices_dirty = True
         self._id_to_node_map  = {}
-
-        self._has_tag_index = False
         self._tag_to_node_map = {}
-
-        self._has_class_index = False
         self._class_to_node_map = {}
-
-    # TODO: since this is recursion maybe recursion unwrapping would be nice
-    #       Look at https://github.com/bagasjs/algo-impl/blob/main/traversal.py
-    def _build_tag_index(self, node: DOMNode):
-        if node.tag not in self._tag_to_node_map:
-            self._tag_to_node_map[node.tag] = []
-        self._tag_to_node_map[node.tag].append(node)
-        for child in node.children:
-            if isinstance(child, DOMNode):
-                self._build_tag_index(child)
-        if node is self.root:
-            self._has_tag_index = True
-
-    # TODO: since this is recursion maybe recursion unwrapping would be nice
-    #       Look at https://github.com/bagasjs/algo-impl/blob/main/traversal.py
-    def _build_id_index(self, node: DOMNode):
-        id_attr = node.attrs.get("id")
-        if id_attr:
-            self._id_to_node_map[id_attr] = node
-        for child in node.children:
-            if isinstance(child, DOMNode):
-                self._build_id_index(child)
-        if node is self.root:
-            self._has_id_index = True
-
-    # TODO: since this is recursion maybe recursion unwrapping would be nice
-    #       Look at https://github.com/bagasjs/algo-impl/blob/main/traversal.py
-    def _build_class_index(self, node: DOMNode):
-        class_attr = node.attrs.get("class")
-        if class_attr:
-            classes = []
-            if isinstance(class_attr, str):
-                classes.extend(class_attr.split())
-            elif isinstance(class_attr, list):
-                classes.extend(class_attr)
-            else:
-                classes.append(str(class_attr))
-            for class_name in classes:
-                if class_name not in self._class_to_node_map:
-                    self._class_to_node_map[class_name] = []
-                self._class_to_node_map[class_name].append(node)
-
-        for child in node.children:
-            if isinstance(child, DOMNode):
-                self._build_class_index(child)
-
-        if node is self.root:
-            self._has_class_index = True
-
-    def get_by_tag(self, name: str) -> Optional[List[DOMNode]]:
-        if not self._has_tag_index:
-            self._build_tag_index(self.root)
-        return self._tag_to_node_map.get(name)
-
-    def get_by_id(self, name: str) -> Optional[DOMNode]:
-        if not self._has_id_index:
-            self._build_id_index(self.root)
-        return self._id_to_node_map.get(name)
-
-    def get_by_class_name(self, name: str) -> Optional[List[DOMNode]]:
-        if not self._has_class_index:
-            self._build_class_index(self.root)
-        return self._class_to_node_map.get(name)
-
-_VOID_TAGS = {
+        # A node only has room for one document, so a document made from part of another
+        # one queries the indexes of its owner filtered to `root` instead of taking the nodes
+        self._owner = root._document
+        if self._owner is None:
+            _attach(root, self)
+
+    def _build_indices(self):
+        self._tag_to_node_map, self._id_to_node_map, self._class_to_node_map = _build_all_indices(self.root)
+        self._indices_dirty = False
+
+    def _insert_subtree(self, parent: DOMNode, child: DOMNode):
+        """
+        Add the subtree of `child`, just appended as the last child of `parent`, into the indexes
+        """
+        if self._indices_dirty:
+            # Everything is rebuilt by the next query anyway
+            return
+
+        # The new nodes go right after the subtree of `parent` and before the node following it
+        old_end = parent._index_end
+        next_start = None
+        node = parent
+        while node is not self.root and node._parent is not None:
+            siblings = node._parent.children
+            for sibling in siblings[siblings.index(node) + 1:]:
+                if isinstance(sibling, DOMNode):
+                    next_start = sibling._index_start
+                    break
+            if next_start is not None:
+                break
+            node = node._parent
+
+        if next_start is None:
+            step = _INDEX_GAP
+        else:
+            count = 0
+            stack = [ child ]
+            while stack:
+                node = stack.pop()
+                count += 1
+                stack.extend(grandchild for grandchild in node.children if isinstance(grandchild, DOMNode))
+            step = (next_start - old_end) // (count + 1)
+            if step == 0:
+                # No room left between the positions, renumber everything on the next query
+                self._indices_dirty = True
+                return
+
+        tag_map, id_map, class_map = _build_all_indices(child, old_end + step, step)
+        # Every ancestor whose subtree ended where the subtree of `parent` did now ends with `child`
+        new_end = child._index_end
+        node = parent
+        while node is not None and node._index_end == old_end:
+            node._index_end = new_end
+            if node is self.root:
+                break
+            node = node._parent
+
+        _merge_nodes(self._tag_to_node_map, tag_map)
+        _merge_nodes(self._class_to_node_map, class_map)
+        id_to_node_map = self._id_to_node_map
+        for id_attr, node in id_map.items():
+            # Same as a full rebuild, the last element in document order wins a duplicate id
+            existing = id_to_node_map.get(id_attr)
+            if existing is None or existing._index_start < node._index_start:
+                id_to_node_map[id_attr] = node
+
+    def get_by_tag(self, name: str, within: Optional[DOMNode] = None) -> Optional[List[DOMNode]]:
+        if self._owner is not None:
+            return self._owner.get_by_tag(name, within=within or self.root)
+        if self._indices_dirty:
+            self._build_indices()
+        nodes = self._tag_to_node_map.get(name)
+        return nodes if within is None else _within(nodes, within)
+
+    def get_by_id(self, name: str, within: Optional[DOMNode] = None) -> Optional[DOMNode]:
+        if self._owner is not None:
+            return self._owner.get_by_id(name, within=within or self.root)
+        if self._indices_dirty:
+            self._build_indices()
+        node = self._id_to_node_map.get(name)
+        if node is None or within is None:
+            return node
+        if within._index_start <= node._index_start <= within._index_end:
+            return node
+        return None
+
+    def get_by_class_name(self, name: str, within: Optional[DOMNode] = None) -> Optional[List[DOMNode]]:
+        if self._owner is not None:
+            return self._owner.get_by_class_name(name, within=within or self.root)
+        if self._indices_dirty:
+            self._build_indices()
+        nodes = self._class_to_node_map.get(name)
+        return nodes if within is None else _within(nodes, within)
+
+_VOID_TAGS: frozenset[str] = frozenset({
     "area", "base", "br", "col", "embed", "hr", "img", 
     "input", "link", "meta", "source", "track", "wbr"
+})
+
+# The tokenizer of HTMLParser walks the source in Python. Most of the scanning can be
+# done by these regexes instead since the `re` engine runs in C.
+_TOKEN_RE = re.compile(r"""
+      <!--(?P<comment>.*?)(?:-->|\Z)
+    | </(?P<endtag>[a-zA-Z][^\s/>]*)[^>]*>
+    | <(?P<starttag>[a-zA-Z][^\s/>]*)(?P<attrs>[^>"']*(?:(?:"[^"]*"|'[^']*')[^>"']*)*)>
+    | <!(?P<decl>[^>]*)>
+    | <\?[^>]*>
+    | (?P<text>[^<]+|<)
+""", re.DOTALL | re.VERBOSE)
+_ATTR_RE = re.compile(r"""([^\s=/>][^\s/=>]*)(?:\s*=\s*(?:"([^"]*)"|'([^']*)'|([^\s>]+)))?""")
+_RAW_TEXT_END_RE = {
+    tag: re.compile(f"</{tag}", re.IGNORECASE) for tag in ("script", "style")
 }
 
+def _scan_attrs(raw_attrs: str) -> Tuple[List[Tuple[str, Optional[str]]], bool]:
+    """
+    Get the attributes of a start tag and whether the tag is self-closing, i.e. it ends
+    with a `/` that isn't part of an attribute value like in <a href=foo/>
+    """
+    attrs = []
+    attrs_end = 0
+    for m in _ATTR_RE.finditer(raw_attrs):
+        name, double_quoted, single_quoted, unquoted = m.groups()
+        value = double_quoted if double_quoted is not None else single_quoted if single_quoted is not None else unquoted
+        attrs.append((name.lower(), unescape(value) if value is not None else None))
+        attrs_end = m.end()
+    return attrs, raw_attrs.endswith("/") and len(raw_attrs) > attrs_end
+
+def _scan_html(parser: HTMLParser, source: str):
+    """
+    Tokenize `source` and dispatch the same handle_* callbacks that HTMLParser.feed() would call
+    """
+    match = _TOKEN_RE.match
+    pos = 0
+    n = len(source)
+    text: List[str] = []
+    while pos < n:
+        m = match(source, pos)
+        pos = m.end()
+        data = m.group("text")
+        if data is not None:
+            text.append(data)
+            continue
+
+        if text:
+            parser.handle_data(unescape("".join(text)))
+            text.clear()
+
+        tag = m.group("starttag")
+        if tag is not None:
+            tag = tag.lower()
+            attrs, self_closing = _scan_attrs(m.group("attrs"))
+            if self_closing:
+                parser.handle_startendtag(tag, attrs)
+                continue
+            parser.handle_starttag(tag, attrs)
+            end_re = _RAW_TEXT_END_RE.get(tag)
+            if end_re is not None:
+                # The content of <script> and <style> is not HTML
+                end = end_re.search(source, pos)
+                end_pos = end.start() if end else n
+                if end_pos > pos:
+                    parser.handle_data(source[pos:end_pos])
+                pos = end_pos
+            continue
+
+        tag = m.group("endtag")
+        if tag is not None:
+            parser.handle_endtag(tag.lower())
+            continue
+
+        data = m.group("comment")
+        if data is not None:
+            parser.handle_comment(data)
+            continue
+
+        data = m.group("decl")
+        if data is not None:
+            parser.handle_decl(data)
+
+    if text:
+        parser.handle_data(unescape("".join(text)))
+
+_FEED_CHUNK_SIZE = 64 * 1024
+
 class _CustomHTMLParser(HTMLParser):
     def __init__(self, source: str):
         super().__init__()
         self.source = source
         self.root_node = DOMNode("DOCUMENT_ROOT", {})
         self.title = None
+        self.title_node = None
         self.node_stack = [ self.root_node ]
 
     def handle_starttag(self, tag, attrs):
-        dom_attrs = {}
-        for key, value in attrs:
-            dom_attrs[key] =  value
-        dom = DOMNode(tag, dom_attrs)
-        self.node_stack[-1].append_child(dom)
-        if tag not in VOID_TAGS:
-            self.node_stack.append(dom)
+        tag = sys.intern(tag)
+        dom = DOMNode(tag, { sys.intern(key): value for key, value in attrs })
+        node_stack = self.node_stack
+        node_stack[-1].append_child(dom)
+        if tag not in _VOID_TAGS:
+            node_stack.append(dom)
 
     def handle_endtag(self, tag):
-        if tag == self.node_stack[-1].tag:
-            dom = self.node_stack.pop()
+        tag = sys.intern(tag)
+        node_stack = self.node_stack
+        if tag == node_stack[-1].tag:
+            dom = node_stack.pop()
             # print("Removed: ", dom.__repr__())
 
     def handle_data(self, data):
         if len(self.node_stack) > 0:
-            if self.node_stack[-1].tag == "title" and self.title is None:
-                self.title = data
-            self.node_stack[-1].append_child(data)
+            top = self.node_stack[-1]
+            children = top.children
+            if children and isinstance(children[-1], str):
+                # The same text can come in several calls (e.g. split between two fed chunks)
+                # so keep it as a single text node
+                data = children[-1] + data
+                children[-1] = data
+                if top is self.title_node:
+                    self.title = data
+            else:
+                top.append_child(data)
+                if top.tag == "title" and self.title is None:
+                    self.title = data
+                    self.title_node = top
 
     def handle_comment(self, data):
         # print("Comment  :", data)
@@ -280,14 +477,68 @@ class _CustomHTMLParser(HTMLParser):
         # print("Decl     :", args, kwargs)
         pass
 
-    def accumulate(self) -> Optional[DOMNode]:
-        self.feed(self.source)
+    def accumulate(self, fast: bool = True) -> Optional[DOMNode]:
+        if fast:
+            _scan_html(self, self.source)
+        else:
+            # Feed the source in blocks so the parser works on a small window at a time
+            source = self.source
+            for i in range(0, len(source), _FEED_CHUNK_SIZE):
+                self.feed(source[i:i + _FEED_CHUNK_SIZE])
+            self.close()
         assert self.root_node == self.node_stack[0]
         return self.root_node
 
-def parse_document(source: str) -> Optional[DOMDocument]:
+def _parse_document_lxml(source: str) -> Optional[DOMDocument]:
+    import lxml.etree as ET
+    root = DOMNode("DOCUMENT_ROOT", {})
+    try:
+        root_lxml = ET.HTML(source)
+    except ValueError:
+        # lxml refuses a str with an encoding declaration (<?xml encoding=...?> or <meta charset>),
+        # the text is already decoded so parse its UTF-8 bytes and ignore the declaration
+        root_lxml = ET.HTML(source.encode("utf-8"), ET.HTMLParser(encoding="utf-8"))
+    if root_lxml is None:
+        return DOMDocument(root, None)
+
+    # Convert the lxml tree without recursion. A str entry is the `tail` of an element
+    # which must come after all of the element's children
+    stack: List[Tuple[Any, DOMNode]] = [ (root_lxml, root) ]
+    while stack:
+        el, parent = stack.pop()
+        if isinstance(el, str):
+            parent.append_child(el)
+            continue
+        if el.tail:
+            stack.append((el.tail, parent))
+        if not isinstance(el.tag, str):
+            # Comments and processing instructions
+            continue
+        node = DOMNode(sys.intern(el.tag), { sys.intern(key): value for key, value in el.attrib.items() })
+        parent.append_child(node)
+        if el.text:
+            node.append_child(el.text)
+        stack.extend((child, node) for child in reversed(el))
+
+    title = root_lxml.find(".//title")
+    return DOMDocument(root, title.text if title is not None else None)
+
+def parse_document(source: str, *, backend: str = "regex") -> Optional[DOMDocument]:
+    """
+    Parse an HTML document. The `backend` can be one of:
+    - "regex"       use the builtin regex based tokenizer
+    - "html.parser" use the html.parser module of the Python Standard Library
+    - "lxml"        use lxml (libxml2) which must be installed. Faster but lxml fixes up
+                    the document, e.g. it adds the missing <html>, <head> and <body>
+                    so the tree may differ from the builtin backends
+    """
+    if backend == "lxml":
+        return _parse_document_lxml(source)
+    if backend not in ("regex", "html.parser"):
+        raise ValueError(f"Unknown backend: {backend}")
+
     parser = _CustomHTMLParser(source)
-    root = parser.accumulate()
+    root = parser.accumulate(fast=backend == "regex")
     if root:
         return DOMDocument(root, parser.title)
 
@@ -10,64 +10,103 @@ Copyright (c) 2025, bagasjs
 License: MIT (see the details at the very bottom)
 """
 
-from __future__ import annotations, with_statement
-from typing import Callable, List, Dict, Any, Tuple
-from enum import StrEnum
+from __future__ import annotations
+from collections.abc import Callable
+from types import MappingProxyType
+import re
+import sys
+
+# Same as typing.TYPE_CHECKING, the typing module is only needed by the annotations
+# so it's not imported at runtime
+TYPE_CHECKING = False
+if TYPE_CHECKING:
+    from typing import List, Dict, Any, Tuple
 
 __author__ = 'bagasjs'
 __version__ = '0.0.1'
 __license__ = 'MIT'
 
-class ValueType(StrEnum):
+# The kinds are interned strings so looking them up in _PARSERS only compares pointers
+class ValueType:
     Int    = "Int"
     Float  = "Float"
     String = "String"
     Bool   = "Bool"
 
 class Opt(object):
+    __slots__ = ("name", "short", "description", "kind", "default_value")
+
     def __init__(self, name: str, kind: ValueType, description: str = "", default_value: Any = None, short: str = ""):
         self.name = name
         self.short = short
         self.description = description
-        self.kind = kind
+        self.kind = sys.intern(kind)
         self.default_value = default_value
 
 class Arg(object):
+    __slots__ = ("name", "kind", "default_value")
+
     def __init__(self, name: str, kind: ValueType, default_value: Any):
         self.name = name
-        self.kind = kind
+        self.kind = sys.intern(kind)
         self.default_value = default_value
 
-CommandCallback = Callable[["Command", List[Any], Dict[str, Any]], None]
+# collections.abc is already loaded at startup unlike typing
+CommandCallback = Callable[["Command", list, dict], None]
 Error = str | None
 
-def parse_value(value: str, kind: ValueType) -> Tuple[Any, Error]:
-    match kind:
-        case ValueType.Int:
-            try:
-                int_value = int(value)
-                return int_value, None
-            except ValueError as err:
-                return 0, str(err)
-        case ValueType.Float:
-            try:
-                float_value = float(value)
-                return float_value, None
-            except ValueError as err:
-                return 0, str(err)
-        case ValueType.String:
-            return value, None
-        case ValueType.Bool:
-            match value:
-                case "true":
-                    return True, None
-                case "false":
-                    return False, None
-                case _:
-                    return value, f"Failed to parse boolean value from {value}"
-        case _:
-            return 0, "Unsupported types"
-
+class CaskParseError(ValueError):
+    pass
+
+# Same syntax as int() and float(): surrounding whitespace and single underscores between digits are allowed
+_DIGITS = r"\d(?:_?\d)*"
+_INT_RE = re.compile(rf"\s*[+-]?{_DIGITS}\s*")
+_FLOAT_RE = re.compile(rf"\s*[+-]?(?:(?:{_DIGITS}(?:\.(?:{_DIGITS})?)?|\.{_DIGITS})(?:e[+-]?{_DIGITS})?|inf|infinity|nan)\s*", re.IGNORECASE)
+_BOOL_VALUES = { "true": True, "false": False }
+
+def _parse_int(value: str) -> int:
+    if _INT_RE.fullmatch(value) is None:
+        raise CaskParseError(f"invalid literal for int() with base 10: {value!r}")
+    return int(value)
+
+def _parse_float(value: str) -> float:
+    if _FLOAT_RE.fullmatch(value) is None:
+        raise CaskParseError(f"could not convert string to float: {value!r}")
+    return float(value)
+
+def _parse_string(value: str) -> str:
+    return value
+
+def _parse_bool(value: str) -> bool:
+    parsed = _BOOL_VALUES.get(value)
+    if parsed is None:
+        raise CaskParseError(f"Failed to parse boolean value from {value}")
+    return parsed
+
+def _parse_unsupported(value: str) -> Any:
+    raise CaskParseError("Unsupported types")
+
+_PARSERS: Dict[ValueType, Callable[[str], Any]] = {
+    sys.intern(kind): parser for kind, parser in (
+        (ValueType.Int,    _parse_int),
+        (ValueType.Float,  _parse_float),
+        (ValueType.String, _parse_string),
+        (ValueType.Bool,   _parse_bool),
+    )
+}
+
+def parse_value(value: str, kind: ValueType) -> Any:
+    """
+    Parse `value` as `kind`, raises CaskParseError if it's not a valid value
+    """
+    return _PARSERS.get(kind, _parse_unsupported)(value)
+
+
+# opt_maps entry for an option that doesn't exist
+_UNKNOWN_OPT = (-1, None)
+# Shared results for the parse_args error path, these must never be mutated
+_EMPTY_LIST: List[Any] = []
+_EMPTY_DICT: Dict[str, Any] = {}
 
 class Command(object):
     use: str
@@ -75,7 +114,15 @@ class Command(object):
     args: List[Arg]
     opts: List[Opt]
 
-    opt_maps: Dict[str, int]
+    opt_maps: Dict[str, Tuple[int, ValueType]]
+    _defaults: MappingProxyType[str, Any]
+    _arg_defaults: List[Any]
+    _n_required: int
+    _usage_str: str | None
+    _opts_cls: type | None
+    _parent: Command | None
+    _dispatch: Dict[Tuple[str, ...], Command] | None
+    _dispatch_depth: int
     subcommands: Dict[str, Command]
     run: CommandCallback | None
 
@@ -90,121 +137,181 @@ class Command(object):
         self.opt_maps = {}
         self.subcommands = {}
         self.run = run
-        if "help" not in self.opt_maps:
+        if not any(opt.name == "help" for opt in self.opts):
             self.opts.append(Opt(name="help", kind=ValueType.Bool, description="Get the `usage` information of a command"))
 
+        for i, opt in enumerate(self.opts):
+            if len(opt.short) != 0:
+                self.opt_maps[sys.intern(opt.short)] = (i, opt.kind)
+            self.opt_maps[sys.intern(opt.name)] = (i, opt.kind)
+        self._defaults = MappingProxyType({ opt.name: opt.default_value for opt in self.opts })
+        self._arg_defaults = [ arg.default_value for arg in self.args ]
+        # Positional arguments up to the last one without a default value must be given
+        self._n_required = max((i + 1 for i, arg in enumerate(self.args) if arg.default_value is None), default=0)
+        self._usage_str = None
+        self._opts_cls = None
+        self._parent = None
+        self._dispatch = None
+        self._dispatch_depth = 0
+
     def add_subcommand(self, command: Command) -> Command:
-        self.subcommands[command.use] = command
+        self._usage_str = None
+        self.subcommands[sys.intern(command.use)] = command
+        command._parent = self
+        # The flattened dispatch table of this command and its ancestors is outdated now
+        parent = self
+        while parent is not None:
+            parent._dispatch = None
+            parent = parent._parent
         return self
 
+    def _flatten(self) -> Dict[Tuple[str, ...], Command]:
+        """
+        Map every path of subcommand names, e.g. ("db", "migrate"), to its command
+        """
+        dispatch: Dict[Tuple[str, ...], Command] = {}
+        stack: List[Tuple[Tuple[str, ...], Command]] = [ ((), self) ]
+        while stack:
+            path, cmd = stack.pop()
+            for name, subcommand in cmd.subcommands.items():
+                subcommand_path = path + (name,)
+                dispatch[subcommand_path] = subcommand
+                stack.append((subcommand_path, subcommand))
+        return dispatch
+
     def parse_args(self, args: List[str]) -> Tuple[List[Any], Dict[str, Any], Error]:
-        args_length = len(args)
-        opts: Dict[str, Any] = {}
+        n = len(args)
+        opts: Dict[str, Any] = self._defaults.copy()
         parsed_args: List[Any] = []
-        cmd_args_length = len(self.args)
-
-        for i, opt in enumerate(self.opts):
-            opts[opt.name] = opt.default_value
-            if len(opt.short) != 0:
-                self.opt_maps[opt.short] = i
-            self.opt_maps[opt.name] = i
+        cmd_args = self.args
+        n_pos = len(cmd_args)
+        pos_i = 0
+        opt_maps = self.opt_maps
+        cmd_opts = self.opts
 
         i = 0
-        while i < args_length:
-            arg = args[i]
-            if arg.startswith("-"):
-                opt_name  = arg.lstrip("-")
-                opt_value = "true" # Default for boolean flags
-                if "=" in opt_name:
-                    parts = opt_name.split("=", 2)
-                    opt_name = parts[0]
-                    opt_value = parts[1]
-                else:
-                    if i + 1 < len(args):
-                        opt_value = args[i+1]
+        try:
+            while i < n:
+                arg = args[i]
+                i += 1
+                dashes = 2 if arg.startswith("--") else (1 if arg.startswith("-") else 0)
+                if dashes:
+                    opt_name, sep, opt_value = arg[dashes:].partition("=")
+                    opt_index, opt_kind = opt_maps.get(opt_name, _UNKNOWN_OPT)
+                    if opt_index < 0:
+                        raise CaskParseError(f"Unknown option: {opt_name}")
+                    if not sep:
+                        if opt_kind == ValueType.Bool:
+                            # A boolean flag without `=value` is just switched on
+                            opts[cmd_opts[opt_index].name] = True
+                            continue
+                        if i >= n:
+                            raise CaskParseError(f"Missing value for option: {opt_name}")
+                        opt_value = args[i]
                         i += 1
-
-
-                if opt_name in self.opt_maps:
-                    opt_index = self.opt_maps[opt_name]
-                    assert type(opt_index) == int
-                    parsed_value, err = parse_value(opt_value, self.opts[opt_index].kind)
-                    if err is not None:
-                        return ([], {}, err)
-                    opts[opt_name] = parsed_value
-                else:
-                    return ([], {}, f"Unknown option: {opt_name}")
-            else:
-                if len(parsed_args) + 1 <= cmd_args_length:
-                    arg_info = self.args[len(parsed_args)]
-                    parsed_arg, err = parse_value(arg, arg_info.kind)
-                    if err is not None:
-                        return ([], {}, err)
-                    parsed_args.append(parsed_arg)
-            i += 1
-
-        if len(parsed_args) < cmd_args_length:
-            return [], {}, "not enough arguments provided"
+                    opts[cmd_opts[opt_index].name] = _PARSERS.get(opt_kind, _parse_unsupported)(opt_value)
+                elif pos_i < n_pos:
+                    parsed_args.append(_PARSERS.get(cmd_args[pos_i].kind, _parse_unsupported)(arg))
+                    pos_i += 1
+
+            if pos_i < self._n_required:
+                raise CaskParseError("not enough arguments provided")
+            parsed_args.extend(self._arg_defaults[pos_i:])
+        except CaskParseError as err:
+            return _EMPTY_LIST, _EMPTY_DICT, str(err)
         return parsed_args, opts, None
 
-    def usage(self):
-        print(f"Usage: {self.use} [SUBCOMMANDS] [OPTIONS]", end="")
-        for arg in self.args:
-            if arg.default_value is not None:
-                print(f"  [{arg.name} ({arg.kind}, default {arg.default_value})]", end="")
-            else:
-                print(f"  <{arg.name} ({arg.kind})>", end="")
-                pass
-        print(f"\n{self.description}")
-
-        if len(self.opts) > 0:
-            print("\nOptions:")
+    def namespace(self, opts: Dict[str, Any]) -> Any:
+        """
+        Turn the `opts` dictionary from parse_args into an object with one slot per option,
+        e.g. opts["assets-path"] becomes ns.assets_path. Useful when a callback reads the
+        options over and over since an attribute load is cheaper than a dictionary lookup.
+        """
+        if self._opts_cls is None:
+            # Only built when asked for, most commands never need it
+            slots: Dict[str, str] = {}
             for opt in self.opts:
-                if opt.short != "":
-                    print(f"  -{opt.short}, --{opt.name}", end="")
+                slot = opt.name.lstrip("-").replace("-", "_")
+                if not slot.isidentifier():
+                    raise ValueError(f"Option `{opt.name}` can't be used as an attribute name")
+                if slot in slots:
+                    raise ValueError(f"Options `{slots[slot]}` and `{opt.name}` both map to the attribute `{slot}`")
+                slots[slot] = opt.name
+            self._opts_cls = type("Opts", (object,), { "__slots__": tuple(slots) })
+        ns = self._opts_cls()
+        for slot, opt in zip(self._opts_cls.__slots__, self.opts):
+            setattr(ns, slot, opts[opt.name])
+        return ns
+
+    def usage(self):
+        if self._usage_str is None:
+            out = [ f"Usage: {self.use} [SUBCOMMANDS] [OPTIONS]" ]
+            for arg in self.args:
+                if arg.default_value is not None:
+                    out.append(f"  [{arg.name} ({arg.kind}, default {arg.default_value})]")
                 else:
-                    print(f"  --{opt.name}", end="")
-                print(f" ({opt.kind})", end="")
-                if opt.default_value != None:
-                    print(f" [default: {opt.default_value}]", end="")
-                if len(opt.description) > 0:
-                    print(f" - {opt.description}", end="")
-                print()
-
-        if len(self.subcommands) > 0:
-            print("\nSubcommands:")
-            for name, subcommand in self.subcommands.items():
-                print(f" {name}: {subcommand.description}")
-        print()
+                    out.append(f"  <{arg.name} ({arg.kind})>")
+            out.append(f"\n{self.description}\n")
+
+            if len(self.opts) > 0:
+                out.append("\nOptions:\n")
+                for opt in self.opts:
+                    if opt.short != "":
+                        out.append(f"  -{opt.short}, --{opt.name}")
+                    else:
+                        out.append(f"  --{opt.name}")
+                    out.append(f" ({opt.kind})")
+                    if opt.default_value != None:
+                        out.append(f" [default: {opt.default_value}]")
+                    if len(opt.description) > 0:
+                        out.append(f" - {opt.description}")
+                    out.append("\n")
+
+            if len(self.subcommands) > 0:
+                out.append("\nSubcommands:\n")
+                for name, subcommand in self.subcommands.items():
+                    out.append(f" {name}: {subcommand.description}\n")
+            out.append("\n")
+            self._usage_str = "".join(out)
+        sys.stdout.write(self._usage_str)
 
     def execute(self, args: List[str]):
-        for i, opt in enumerate(self.opts):
-            self.opt_maps[opt.name] = i
-
-        if len(args) == 0 and self.run is None:
-            return self.usage()
-
-        if len(args) > 0:
-            subcommand_name = args[0]
-            if subcommand_name in self.subcommands:
-                subcommand = self.subcommands[args[0]]
-                return subcommand.execute(args[1:])
-
-        parsed_args, opts, err = self.parse_args(args)
+        if self._dispatch is None:
+            self._dispatch = self._flatten()
+            self._dispatch_depth = max(map(len, self._dispatch), default=0)
+
+        # Find the deepest subcommand named by the leading arguments
+        cmd = self
+        for i in range(min(self._dispatch_depth, len(args)), 0, -1):
+            subcommand = self._dispatch.get(tuple(args[:i]))
+            if subcommand is not None:
+                cmd = subcommand
+                args = args[i:]
+                break
+
+        if len(args) == 0 and cmd.run is None:
+            return cmd.usage()
+
+        # Show the help without validating the other arguments. `-h` is only a help flag
+        # when the command doesn't use it as the short name of another option
+        for arg in args:
+            if arg == "--help" or arg == "-help" or (arg == "-h" and "h" not in cmd.opt_maps):
+                return cmd.usage()
+
+        parsed_args, opts, err = cmd.parse_args(args)
         if err is not None:
             print("ERROR:", err, end="\n\n")
-            return self.usage()
+            return cmd.usage()
 
         if "help" in opts and opts["help"]:
-            return self.usage()
+            return cmd.usage()
 
-        if self.run:
-            self.run(self, parsed_args, opts)
+        if cmd.run:
+            cmd.run(cmd, parsed_args, opts)
         else:
-            self.usage()
+            cmd.usage()
 
 def execute(command: Command):
-    import sys
     return command.execute(sys.argv[1:])
 
 def example_app():